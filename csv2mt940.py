@@ -41,8 +41,13 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 
-import sys, os, re, csv, io, datetime, argparse
-from typing import List
+import sys, os, re, codecs, datetime, argparse, functools, itertools, operator
+from typing import List, Tuple
+
+# highest column index read from a TopCard row is 12 (booking date)
+MIN_COLUMNS = 13
+# card exports can be tens of MB; fewer, larger reads/writes than the 8 KiB default
+IO_BUFFER = 1 << 20
 
 def print_table(rows: List[List[str]], headers: List[str]) -> None:
     cols = list(zip(*([headers] + rows))) if rows else [headers]
@@ -54,10 +59,39 @@ def print_table(rows: List[List[str]], headers: List[str]) -> None:
 def fail(msg: str, exit_code: int = 2) -> None:
     print(f"ERROR: {msg}", file=sys.stderr); sys.exit(exit_code)
 
-def wrap_86(text: str, width: int = 65, max_lines: int = 6) -> List[str]:
-    clean = " ".join(text.split())
-    lines = [clean[i:i+width] for i in range(0, len(clean), width)] or [""]
-    return lines[:max_lines]
+# merchant texts repeat a lot in card statements; results are tuples so the
+# cached values cannot be mutated by callers
+@functools.lru_cache(maxsize=4096)
+def wrap_86(text: str, width: int = 65, max_lines: int = 6) -> Tuple[str, ...]:
+    # isprintable() rules out tabs, newlines and non-ASCII spaces; with no
+    # double spaces left there is nothing to collapse
+    if "  " not in text and text.isprintable():
+        clean = text.strip(" ")
+    else:
+        clean = " ".join(text.split())
+    if len(clean) <= width:
+        return (clean,)[:max_lines]
+    return tuple(clean[i:i+width] for i in range(0, min(len(clean), width*max_lines), width))
+
+# the :86: block only depends on comment/tags and fixed options, so whole
+# blocks are reused for repeated merchants
+@functools.lru_cache(maxsize=4096)
+def field_86(comment: str, tags: str, first_line: str, starmoney: bool) -> str:
+    if starmoney:
+        head = wrap_86(first_line, 65, 6)
+        return ":86:" + "\r\n".join(head + wrap_86(f"SVWZ+{comment}", 65, 6 - len(head))) + "\r\n"
+    parts_86 = wrap_86(comment or "", 65, 6)
+    tag_list = [t.strip() for t in (tags.split(",") if tags else []) if t.strip()]
+    tag_text = ("; ".join(tag_list)) if tag_list else ""
+    lines = [l for l in parts_86 if l] + ([tag_text] if tag_text else [])
+    return ":86:" + ("\r\n".join(lines)) + "\r\n"
+
+def swift_date(d: str, line_no: int) -> str:
+    # 'DD.MM.YYYY' -> 'YYMMDD'
+    if len(d) >= 10 and d[2] == "." and d[5] == ".":
+        return d[8:10] + d[3:5] + d[0:2]
+    fail("Unexpected date format (expected DD.MM.YYYY).\n"
+         f"  Line: {line_no}\n  Value: '{d}'")
 
 def parse_args(argv: List[str]) -> argparse.Namespace:
     p = argparse.ArgumentParser(
@@ -118,7 +152,7 @@ def main(argv: List[str]) -> None:
     args = parse_args(argv)
 
     try:
-        csvFile = open(args.input_csv, "r", encoding=args.encoding, newline="")
+        csvFile = open(args.input_csv, "r", encoding=args.encoding, newline="", buffering=IO_BUFFER)
     except Exception as e:
         fail("Failed to open input CSV.\n"
              f"  File: {args.input_csv}\n"
@@ -127,7 +161,7 @@ def main(argv: List[str]) -> None:
              f"  Error: {type(e).__name__}: {e}" )
 
     try:
-        mt940File = io.open(args.output_sta, "w", encoding="utf-8", newline="")
+        mt940File = open(args.output_sta, "wb", buffering=IO_BUFFER)
     except Exception as e:
         fail("Failed to create/open output file.\n"
              f"  File: {args.output_sta}\n"
@@ -135,64 +169,68 @@ def main(argv: List[str]) -> None:
              f"  Error: {type(e).__name__}: {e}" )
 
     print("----- > Start processing")
-    reader = csv.reader(csvFile, delimiter=args.delimiter)
 
     lineNumber = 0
     tx_count = 0
-    bodies: List[str] = []
     header = ""
-    opening_date = ""
+    opening_ymd = ""
     closing_date = ""
     currency_fallback = "EUR"
 
     debug_rows: List[List[str]] = []
 
+    # booking, valuta, comment, tags, account, currency, amount, amountC
+    pick_fields = operator.itemgetter(12, 3, 4, 5, 1, 7, 10, 11)
+
+    # options are fixed for the whole run; resolve them once
+    delimiter = args.delimiter
+    footer = f"{delimiter*4}Total"
+    starmoney = args.profile == "starmoney"
+    ttype = args.ttype.strip().upper() if starmoney else "FCHG"
+    eref = args.eref or "NONREF"
+    purp = args.purp.strip()
+    first_line = f"EREF+{eref}"
+    if purp: first_line += f" PURP+{purp}"
+    debug = args.debug
+    limit = args.limit
+
+    bodies: List[bytes] = []
+
     try:
-        for row in reader:
+        # TopCard exports are plain ';'-separated without quoting, so a split
+        # per line is enough (and much cheaper than the csv module).
+        # Lines are pulled in ~IO_BUFFER sized batches rather than one by one.
+        chunks = iter(lambda: csvFile.readlines(IO_BUFFER), [])
+        for raw in itertools.chain.from_iterable(chunks):
             lineNumber += 1
             if lineNumber < 3:
                 continue
-            if not row or all(c.strip() == "" for c in row):
+            line = raw.rstrip("\r\n")
+            # blank lines and rows made of empty columns only
+            if not line.replace(delimiter, "").strip():
                 continue
-            joined = args.delimiter.join(row).strip()
-            if joined.startswith(f"{args.delimiter*4}Total"):
+            if line.lstrip().startswith(footer):
                 continue
+            row = line.split(delimiter)
 
-            needed_idx = [1,3,4,5,7,10,11,12]
-            if len(row) <= max(needed_idx):
+            if len(row) < MIN_COLUMNS:
                 fail("CSV row has too few columns.\n"
                      f"  Line (incl. header): {lineNumber}\n"
-                     f"  Columns: {len(row)} Needed: >= {max(needed_idx)+1}\n"
-                     f"  Row: {joined}")
-
-            booking = row[12].strip()
-            valuta  = row[3].strip()
-            comment = row[4].strip()
-            tags    = row[5].strip()
-            account = row[1].strip()
-            curr    = row[7].strip() or currency_fallback
-            amt     = row[10].strip()
-            amt_alt = row[11].strip()
-
-            def date_parts(d: str) -> tuple:
-                if len(d) >= 10 and d[2] == "." and d[5] == ".":
-                    return d[8:10], d[3:5], d[0:2]
-                fail("Unexpected date format (expected DD.MM.YYYY).\n"
-                     f"  Line: {lineNumber}\n  Value: '{d}'")
-            yy_b, mm_b, dd_b = date_parts(booking)
-            yy_v, mm_v, dd_v = date_parts(valuta)
-
-            eref = args.eref or "NONREF"
-            svwz = comment
-            purp = args.purp.strip()
-
-            val = amt if amt.strip() else amt_alt
-            if not val.strip():
+                     f"  Columns: {len(row)} Needed: >= {MIN_COLUMNS}\n"
+                     f"  Row: {line}")
+
+            booking, valuta, comment, tags, account, curr, amt, amt_alt = map(str.strip, pick_fields(row))
+            curr = curr or currency_fallback
+
+            v_ymd = swift_date(valuta, lineNumber)
+            # booking date usually equals the value date
+            b_md = v_ymd[2:] if booking == valuta else swift_date(booking, lineNumber)[2:]
+
+            val = amt or amt_alt
+            if not val:
                 fail("Neither amount (col 10) nor amountC (col 11) has a value.\n"
-                     f"  Line: {lineNumber}\n  Row: {joined}")
-            dc = "D"
-            if not amt.strip() and amt_alt.strip():
-                dc = "C"
+                     f"  Line: {lineNumber}\n  Row: {line}")
+            dc = "D" if amt else "C"
             val = val.replace(".", ",")  # SWIFT uses comma decimals
 
             if not header:
@@ -200,48 +238,37 @@ def main(argv: List[str]) -> None:
                 header  = f":20:DateOfConversion{now}\r\n"
                 header += f":25:{account}\r\n"
                 header += ":28C:00001/001\r\n"
-                closing_date = f"{dd_v}{mm_v}{yy_v}"
-
-            ttype = args.ttype.strip().upper() if args.profile == "starmoney" else "FCHG"
-            body  = f":61:{yy_v}{mm_v}{dd_v}{mm_b}{dd_b}{dc}{val}{ttype}NONREF//NONREF\r\n"
-
-            if args.profile == "starmoney":
-                parts_86 = []
-                first_line = f"EREF+{eref}"
-                if purp: first_line += f" PURP+{purp}"
-                parts_86.extend(wrap_86(first_line, 65, 6))
-                sv_lines = wrap_86(f"SVWZ+{svwz}" if svwz else "SVWZ+", 65, 6 - len(parts_86))
-                parts_86.extend(sv_lines)
-                body += ":86:" + ("\r\n".join(parts_86)) + "\r\n"
-            else:
-                parts_86 = wrap_86(comment or "", 65, 6)
-                tag_list = [t.strip() for t in (tags.split(",") if tags else []) if t.strip()]
-                tag_text = ("; ".join(tag_list)) if tag_list else ""
-                lines = [l for l in parts_86 if l] + ([tag_text] if tag_text else [])
-                body += (":86:" + ("\r\n".join(lines)) + "\r\n")
-
-            bodies.append(body)
+                closing_date = v_ymd[4:] + v_ymd[2:4] + v_ymd[:2]
+
+            body  = f":61:{v_ymd}{b_md}{dc}{val}{ttype}NONREF//NONREF\r\n"
+            body += field_86(comment, tags, first_line, starmoney)
+
+            bodies.append(body.encode("utf-8"))
             tx_count += 1
-            opening_date = f"{dd_v}{mm_v}{yy_v}"
+            opening_ymd = v_ymd
 
-            if args.debug:
+            if debug:
                 debug_rows.append([str(lineNumber), valuta, booking, dc, val, curr,
-                                   (comment[:32] + "…") if len(comment) > 33 else comment])
+                                   (comment[:32] + "…") if comment[33:34] else comment])
 
-            if args.limit and tx_count >= args.limit:
+            if limit and tx_count >= limit:
                 break
     finally:
         csvFile.close()
 
-    mt940File.write("\ufeff")
-    mt940File.write(header)
+    opening_date = opening_ymd[4:] + opening_ymd[2:4] + opening_ymd[:2]
+
+    # output is UTF-8 with BOM; written as bytes so each body is encoded once
+    mt940File.write(codecs.BOM_UTF8)
+    mt940File.write(header.encode("utf-8"))
     if not args.suppress_balances:
-        mt940File.write(f":60F:C{opening_date}{curr}0,0\r\n")
-    for i in range(tx_count, 0, -1):
-        mt940File.write(bodies[i-1])
+        mt940File.write(f":60F:C{opening_date}{curr}0,0\r\n".encode("utf-8"))
+    # TopCard lists the newest booking first; MT940 runs oldest to newest
+    # (:60F from the last CSV row, :62F from the first)
+    mt940File.writelines(reversed(bodies))
     if not args.suppress_balances:
-        mt940File.write(f":62F:C{closing_date}{curr}0,0\r\n")
-    mt940File.write("\r\n")
+        mt940File.write(f":62F:C{closing_date}{curr}0,0\r\n".encode("utf-8"))
+    mt940File.write(b"\r\n")
     mt940File.close()
 
     print("----- < end processing")